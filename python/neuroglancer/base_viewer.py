@@ -24,8 +24,46 @@ except ImportError:
     # Python 3 case
     from urllib.parse import quote as urlquote  # pylint: disable=no-name-in-module,import-error
 
+try:
+    import orjson
+
+    def encode_json(obj):
+        """Serialize obj to a compact JSON string using orjson."""
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY).decode('utf-8')
+except ImportError:
+
+    def encode_json(obj):
+        """Serialize obj to a compact JSON string using the stdlib json."""
+        return json.dumps(obj, separators=(',', ':'))
+
 from . import volume
 
+# Characters (beyond urlquote's always-safe unreserved set) left unescaped in
+# the encoded viewer state.
+_STATE_SAFE_CHARS = '~@#$&()*!+=:;,.?/\''
+
+# Ordinal -> '%XX' escape for every ASCII character that must be quoted;
+# characters absent from the table are passed through by str.translate.
+_STATE_QUOTE_TABLE = {}
+for _b in range(128):
+    _c = chr(_b)
+    if not (_c.isalnum() and _c.isascii()) and _c not in '_.-~' + _STATE_SAFE_CHARS:
+        _STATE_QUOTE_TABLE[_b] = '%%%02X' % _b
+
+
+def quote_state(state):
+    """URL-quote an encoded state string.
+
+    Equivalent to urlquote(state, _STATE_SAFE_CHARS), but a single
+    str.translate pass over the precomputed escape table for the common
+    all-ASCII case.
+    """
+    try:
+        state.encode('ascii')
+    except UnicodeEncodeError:
+        return urlquote(state, _STATE_SAFE_CHARS)
+    return state.translate(_STATE_QUOTE_TABLE)
+
 class Layer(object):
     def __init__(self,
                  data,
@@ -47,6 +85,7 @@ class Layer(object):
             voxel_size = default_voxel_size
         self.volume = volume.ServedVolume(data=data, offset=offset, voxel_size=voxel_size, **kwargs)
         self.name = name
+        self._layer_spec_cache = {}
         extra_args = self.extra_args = dict()
         if shader is not None:
             extra_args['shader'] = shader
@@ -54,36 +93,64 @@ class Layer(object):
             extra_args['visible'] = visible
 
     def get_layer_spec(self, server_url):
-        return dict(type=self.volume.volume_type,
-                    source='python://%s/%s' % (server_url, self.volume.token),
-                    **self.extra_args)
+        # The spec is a pure function of the server URL (volume type and token
+        # are fixed at construction), and the URL rarely changes; keep the
+        # last result per URL.
+        spec = self._layer_spec_cache.get(server_url)
+        if spec is None:
+            spec = dict(type=self.volume.volume_type,
+                        source='python://%s/%s' % (server_url, self.volume.token),
+                        **self.extra_args)
+            self._layer_spec_cache = {server_url: spec}
+        return spec
 
 
 class BaseViewer(object):
     def __init__(self, voxel_size=(1, 1, 1)):
         self.voxel_size = voxel_size
         self.layers = []
+        self._cached_json_state = None
+        self._cached_encoded_state = None
 
     def add(self, *args, **kwargs):
         layer = Layer(*args, default_voxel_size=self.voxel_size, **kwargs)
         self.layers.append(layer)
+        self._cached_json_state = None
+        self._cached_encoded_state = None
 
     def get_json_state(self):
+        # The state only changes when a layer is added, so cache it between
+        # add() calls.
+        if self._cached_json_state is not None:
+            return self._cached_json_state
         state = collections.OrderedDict()
         layers = state['layers'] = collections.OrderedDict()
         specified_names = set(layer.name for layer in self.layers)
+        # Next numeric suffix to try per base name, so that naming M unnamed
+        # layers of the same volume type stays linear instead of restarting
+        # the suffix search from 2 for each of them.
+        next_suffixes = {}
         for layer in self.layers:
             self.register_volume(layer.volume)
             name = layer.name
             if name is None:
                 base_name = layer.volume.volume_type
-                name = base_name
-                suffix = 2
-                while name in specified_names:
+                suffix = next_suffixes.get(base_name)
+                if suffix is None and base_name not in specified_names:
+                    name = base_name
+                    suffix = 2
+                else:
+                    if suffix is None:
+                        suffix = 2
                     name = '%s%d' % (base_name, suffix)
+                    while name in specified_names:
+                        suffix += 1
+                        name = '%s%d' % (base_name, suffix)
                     suffix += 1
+                next_suffixes[base_name] = suffix
                 specified_names.add(name)
             layers[name] = layer.get_layer_spec(self.get_server_url())
+        self._cached_json_state = state
         return state
 
     def register_volume(self, vol):
@@ -101,6 +168,6 @@ class BaseViewer(object):
         raise NotImplementedError
 
     def get_encoded_state(self):
-        return urlquote(
-            json.dumps(self.get_json_state(), separators=(',', ':')),
-            '~@#$&()*!+=:;,.?/\'')
+        if self._cached_encoded_state is None:
+            self._cached_encoded_state = quote_state(encode_json(self.get_json_state()))
+        return self._cached_encoded_state
@@ -19,6 +19,10 @@ import numpy as np
 
 
 def encode_jpeg(subvol):
+    # PIL copies non-contiguous input internally; make the (single) copy
+    # explicitly so that contiguous subvolumes are passed through zero-copy.
+    if not subvol.flags.c_contiguous:
+        subvol = np.ascontiguousarray(subvol)
     shape = subvol.shape
     reshaped = subvol.reshape(shape[0] * shape[1], shape[2])
     img = Image.fromarray(reshaped)
@@ -37,4 +41,4 @@ def encode_npz(subvol):
 
 
 def encode_raw(subvol):
-    return subvol.tostring('C')
+    return subvol.tobytes('C')
@@ -15,8 +15,19 @@
 from __future__ import division
 
 import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 
+try:
+    import tinybrain
+except ImportError:
+    tinybrain = None
+
+# Shared pool for per-channel downsampling; threads are only created on use.
+_channel_pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 1)
+
 
 def downsample_with_averaging(array, factor):
     """Downsample x by factor using averaging.
@@ -24,15 +35,39 @@ def downsample_with_averaging(array, factor):
     @return: The downsampled array, of the same type as x.
     """
     factor = tuple(factor)
+    if tinybrain is not None and array.dtype.kind in 'uf':
+        # tinybrain dispatches to a SIMD fast path for power-of-two factors on
+        # Fortran-order arrays, avoiding the per-offset accumulation passes
+        # below.  It accepts 3-d and 4-d arrays with a factor per axis.
+        return tinybrain.downsample_with_averaging(
+            np.asfortranarray(array), factor=factor, num_mips=1)[0]
+    if len(array.shape) == 4 and array.shape[0] > 1 and factor[0] == 1:
+        # Downsample channels concurrently into a preallocated output; the
+        # numpy accumulation releases the GIL, so this scales with the number
+        # of channels.
+        channel_factor = factor[1:]
+        output_shape = (array.shape[0], ) + tuple(
+            math.ceil(s / f) for s, f in zip(array.shape[1:], channel_factor))
+        out = np.empty(output_shape, array.dtype)
+
+        def downsample_channel(c):
+            out[c] = _downsample_with_averaging(array[c], channel_factor)
+
+        list(_channel_pool.map(downsample_channel, range(array.shape[0])))
+        return out
+    return _downsample_with_averaging(array, factor)
+
+
+def _downsample_with_averaging(array, factor):
     output_shape = tuple(math.ceil(s / f) for s, f in zip(array.shape, factor))
     temp = np.zeros(output_shape, float)
-    counts = np.zeros(output_shape, np.int)
+    counts = np.zeros(output_shape, int)
     for offset in np.ndindex(factor):
         part = array[tuple(np.s_[o::f] for o, f in zip(offset, factor))]
         indexing_expr = tuple(np.s_[:s] for s in part.shape)
         temp[indexing_expr] += part
         counts[indexing_expr] += 1
-    return np.cast[array.dtype](temp / counts)
+    return (temp / counts).astype(array.dtype)
 
 
 def downsample_with_striding(array, factor):
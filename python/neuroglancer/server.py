@@ -108,20 +108,24 @@ class RequestHandler(BaseHTTPRequestHandler):
             self.send_error(404)
             return
         try:
-            data, content_type = volume.get_encoded_subvolume(data_format,
-                                                              start,
-                                                              end,
-                                                              scale_key=scale_key)
+            content_type, chunk_iterator = volume.get_encoded_subvolume_stream(
+                data_format, start, end, scale_key=scale_key)
         except ValueError as e:
             self.send_error(400, e.args[0])
             return
 
+        # Stream the encoded data with chunked transfer encoding, so the first
+        # piece reaches the client before the full response is assembled.
         self.send_response(200)
         self.send_header('Content-type', content_type)
-        self.send_header('Content-length', len(data))
+        self.send_header('Transfer-Encoding', 'chunked')
         self.send_header('Access-Control-Allow-Origin', '*')
         self.end_headers()
-        self.wfile.write(data)
+        for chunk in chunk_iterator:
+            self.wfile.write(b'%x\r\n' % len(chunk))
+            self.wfile.write(chunk)
+            self.wfile.write(b'\r\n')
+        self.wfile.write(b'0\r\n\r\n')
 
     def handle_info_request(self, token):
         volume = self.server.volumes.get(token)
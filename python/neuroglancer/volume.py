@@ -15,18 +15,26 @@
 from __future__ import absolute_import, division
 
 import collections
+import threading
+
 import numpy as np
 
 from .chunks import encode_jpeg, encode_npz, encode_raw
 from .token import make_random_token
 from . import downsample
 from . import downsample_scales
+from . import volume_kernels
+
+try:
+    import dask.array
+except ImportError:
+    dask = None
 
-DownsamplingScaleInfo = collections.namedtuple('DownsamplingScaleInfo', ['key',
-                                                                         'downsample_factor',
-                                                                         'voxel_size',
-                                                                         'shape', ])
+# Size of the pieces yielded by get_encoded_subvolume_stream.
+STREAM_CHUNK_SIZE = 64 * 1024
 
+# Default byte budget for the per-volume cache of encoded tiles.
+DEFAULT_MAX_CACHE_BYTES = 128 * 1024 * 1024
 
 def get_scale_key(scale):
     return '%d,%d,%d' % scale
@@ -44,7 +52,9 @@ class ServedVolume(object):
                  downsampling='3d',
                  max_downsampling=downsample_scales.DEFAULT_MAX_DOWNSAMPLING,
                  max_downsampled_size=downsample_scales.DEFAULT_MAX_DOWNSAMPLED_SIZE,
-                 max_downsampling_scales=downsample_scales.DEFAULT_MAX_DOWNSAMPLING_SCALES):
+                 max_downsampling_scales=downsample_scales.DEFAULT_MAX_DOWNSAMPLING_SCALES,
+                 precompute_pyramid=True,
+                 max_cache_bytes=DEFAULT_MAX_CACHE_BYTES):
         """Initializes a ServedVolume.
 
     @param data: 3-d [z, y, x] array or 4-d [channel, z, y, x] array.
@@ -55,9 +65,24 @@ class ServedVolume(object):
     @param max_downsampling: Maximum amount by which on-the-fly downsampling may
         reduce the volume of a chunk.  For example, 4x4x4 downsampling reduces
         the volume by 64.
+
+    @param precompute_pyramid: Downsample the full volume once per scale at
+        construction time, so that chunk requests at coarse scales are served
+        by slicing rather than by re-downsampling the requested region.  Set
+        to False to trade request latency for memory.
+
+    @param max_cache_bytes: Byte budget for the cache of encoded tiles.
+        Identical tile requests (as issued when panning back and forth or by
+        multiple viewers) are then served from the cache.  Set to 0 to
+        disable caching.
     """
         self.token = make_random_token()
         self.max_voxels_per_chunk_log2 = max_voxels_per_chunk_log2
+        self._info = None
+        self.max_cache_bytes = max_cache_bytes
+        self._encoded_cache = collections.OrderedDict()
+        self._encoded_cache_bytes = 0
+        self._encoded_cache_lock = threading.Lock()
         self.data = data
         if voxel_offset is not None:
             if offset is not None:
@@ -84,6 +109,13 @@ class ServedVolume(object):
                 volume_type = 'image'
         self.volume_type = volume_type
 
+        # Global intensity range used to quantize floating-point data for
+        # JPEG encoding; computed once here rather than per request.
+        if data.dtype.kind == 'f' and isinstance(data, np.ndarray):
+            self._norm = (float(data.min()), float(data.max()))
+        else:
+            self._norm = None
+
         voxel_size = np.array(voxel_size)
 
         self.two_dimensional_scales = None
@@ -108,15 +140,90 @@ class ServedVolume(object):
                 max_downsampled_size=max_downsampled_size,
                 max_scales=max_downsampling_scales)
             downsampling_scales = [s for level in self.two_dimensional_scales for s in level]
-        downsampling_scale_info = self.downsampling_scale_info = {}
+        # Scale metadata is kept struct-of-arrays style: one (num_scales, 3)
+        # array per field, indexed through scale_key_to_index.  The request
+        # path then reads small numpy views rather than per-scale Python
+        # structures, and the bounds check stays a single vectorized compare.
+        self.scale_key_to_index = {}
+        unique_scales = []
         for scale in downsampling_scales:
-            info = DownsamplingScaleInfo(key=get_scale_key(scale),
-                                         voxel_size=tuple(voxel_size * scale),
-                                         downsample_factor=scale,
-                                         shape=tuple(np.cast[int](np.ceil(original_shape / scale))))
-            downsampling_scale_info[info.key] = info
+            key = get_scale_key(scale)
+            if key not in self.scale_key_to_index:
+                self.scale_key_to_index[key] = len(unique_scales)
+                unique_scales.append(tuple(scale))
+        scales_array = np.asarray(unique_scales, dtype=np.int64)
+        self.downsample_factors = unique_scales
+        self.scale_voxel_sizes = voxel_size[np.newaxis, :] * scales_array
+        self.scale_shapes = np.ceil(original_shape[np.newaxis, :] /
+                                    scales_array).astype(np.int64)
+
+        self.downsampled_data = {}
+        # Precomputing the pyramid would materialize every level in RAM, so it
+        # only applies to in-memory arrays; lazy arrays (dask, zarr, h5py)
+        # stay on the on-the-fly path, which crops before materializing.
+        if precompute_pyramid and isinstance(data, np.ndarray):
+            for key, index in self.scale_key_to_index.items():
+                downsample_factor = self.downsample_factors[index]
+                if downsample_factor == (1, 1, 1):
+                    continue
+                self.downsampled_data[key] = self._downsample(data, downsample_factor)
+
+    def _crop_and_downsample(self, start, end, downsample_factor):
+        if downsample_factor != (1, 1, 1) and self.volume_type == 'image':
+            # Fused single-pass crop + downsample, if numba is available.
+            subvol = volume_kernels.crop_downsample(self.data, start, end, downsample_factor)
+            if subvol is not None:
+                return subvol
+        indexing_expr = (slice(start[2] * downsample_factor[2],
+                               end[2] * downsample_factor[2]),
+                         slice(start[1] * downsample_factor[1],
+                               end[1] * downsample_factor[1]),
+                         slice(start[0] * downsample_factor[0],
+                               end[0] * downsample_factor[0]))
+        if len(self.data.shape) == 3:
+            subvol = self.data[indexing_expr]
+        else:
+            subvol = self.data[(np.s_[:], ) + indexing_expr]
+        if downsample_factor != (1, 1, 1):
+            subvol = self._downsample(subvol, downsample_factor)
+        return subvol
+
+    def _quantize_to_uint8(self, subvol):
+        """Scales a floating-point subvolume to uint8 for JPEG encoding."""
+        if self._norm is not None:
+            lo, hi = self._norm
+        else:
+            lo = float(subvol.min())
+            hi = float(subvol.max())
+        if hi <= lo:
+            return np.zeros(subvol.shape, np.uint8)
+        scaled = np.subtract(subvol, lo, dtype=np.float32)
+        np.multiply(scaled, 255.0 / (hi - lo), out=scaled)
+        return scaled.astype(np.uint8)
+
+    def _downsample(self, subvol, downsample_factor):
+        if len(subvol.shape) == 3:
+            full_downsample_factor = downsample_factor[::-1]
+        else:
+            full_downsample_factor = (1, ) + downsample_factor[::-1]
+        if dask is not None and isinstance(subvol, dask.array.Array):
+            if (self.volume_type == 'image' and
+                    all(s % f == 0 for s, f in zip(subvol.shape, full_downsample_factor))):
+                # Stream the reduction chunk by chunk instead of materializing
+                # the full-resolution crop.
+                coarsened = dask.array.coarsen(np.mean, subvol,
+                                               dict(enumerate(full_downsample_factor)))
+                return coarsened.astype(subvol.dtype).compute()
+            subvol = np.asarray(subvol)
+        if self.volume_type == 'image':
+            return downsample.downsample_with_averaging(subvol, full_downsample_factor)
+        return downsample.downsample_with_striding(subvol, full_downsample_factor)
 
     def info(self):
+        # The info response is a pure function of construction state; build it
+        # once and reuse it for every request.
+        if self._info is not None:
+            return self._info
         info = dict(volumeType=self.volume_type,
                     dataType=self.data_type,
                     encoding=self.encoding,
@@ -125,11 +232,14 @@ class ServedVolume(object):
             info['maxVoxelsPerChunkLog2'] = self.max_voxels_per_chunk_log2
 
         def get_scale_info(s):
-            info = self.downsampling_scale_info[get_scale_key(s)]
-            return dict(key='%s/%s' % (self.token, info.key),
+            key = get_scale_key(s)
+            index = self.scale_key_to_index[key]
+            # tolist() yields Python scalars, keeping the result
+            # JSON-serializable.
+            return dict(key='%s/%s' % (self.token, key),
                         offset=self.offset,
-                        sizeInVoxels=info.shape,
-                        voxelSize=info.voxel_size)
+                        sizeInVoxels=tuple(self.scale_shapes[index].tolist()),
+                        voxelSize=tuple(self.scale_voxel_sizes[index].tolist()))
 
         if self.two_dimensional_scales is not None:
             info['twoDimensionalScales'] = [[get_scale_info(s) for s in level]
@@ -137,34 +247,70 @@ class ServedVolume(object):
         if self.three_dimensional_scales is not None:
             info['threeDimensionalScales'] = [get_scale_info(s)
                                               for s in self.three_dimensional_scales]
+        self._info = info
         return info
 
     def get_encoded_subvolume(self, data_format, start, end, scale_key='1,1,1'):
-        scale_info = self.downsampling_scale_info.get(scale_key)
-        if scale_info is None:
+        cache_key = (data_format, scale_key, tuple(start), tuple(end))
+        with self._encoded_cache_lock:
+            cached = self._encoded_cache.get(cache_key)
+            if cached is not None:
+                # Re-insert to mark the entry as most recently used.
+                self._encoded_cache[cache_key] = self._encoded_cache.pop(cache_key)
+                return cached
+        data, content_type = self._encode_subvolume(data_format, start, end, scale_key)
+        if 0 < len(data) <= self.max_cache_bytes:
+            with self._encoded_cache_lock:
+                if cache_key not in self._encoded_cache:
+                    self._encoded_cache[cache_key] = (data, content_type)
+                    self._encoded_cache_bytes += len(data)
+                    while self._encoded_cache_bytes > self.max_cache_bytes:
+                        _, (evicted, _) = self._encoded_cache.popitem(last=False)
+                        self._encoded_cache_bytes -= len(evicted)
+        return data, content_type
+
+    def invalidate(self):
+        """Discards cached results after the underlying data has been mutated.
+
+        Clears the cache of encoded tiles and recomputes any precomputed
+        downsampled volumes from the current data.
+        """
+        with self._encoded_cache_lock:
+            self._encoded_cache.clear()
+            self._encoded_cache_bytes = 0
+        for key in self.downsampled_data:
+            downsample_factor = self.downsample_factors[self.scale_key_to_index[key]]
+            self.downsampled_data[key] = self._downsample(self.data, downsample_factor)
+
+    def _encode_subvolume(self, data_format, start, end, scale_key):
+        scale_index = self.scale_key_to_index.get(scale_key)
+        if scale_index is None:
             raise ValueError('Invalid scale.')
-        shape = scale_info.shape
-        downsample_factor = scale_info.downsample_factor
-        for i in xrange(3):
-            if end[i] < start[i] or start[i] < 0 or end[i] > shape[i]:
-                raise ValueError('Out of bounds data request.')
-
-        indexing_expr = tuple(np.s_[start[i] * downsample_factor[i]:end[i] * downsample_factor[i]]
-                              for i in (2, 1, 0))
-        if len(self.data.shape) == 3:
-            full_downsample_factor = downsample_factor[::-1]
-            subvol = self.data[indexing_expr]
-        else:
-            full_downsample_factor = (1, ) + downsample_factor[::-1]
-            subvol = self.data[(np.s_[:], ) + indexing_expr]
+        downsample_factor = self.downsample_factors[scale_index]
+        start = np.asarray(start, dtype=np.int64)
+        end = np.asarray(end, dtype=np.int64)
+        if np.any((end < start) | (start < 0) | (end > self.scale_shapes[scale_index])):
+            raise ValueError('Out of bounds data request.')
 
-        if downsample_factor != (1, 1, 1):
-            if self.volume_type == 'image':
-                subvol = downsample.downsample_with_averaging(subvol, full_downsample_factor)
+        downsampled = self.downsampled_data.get(scale_key)
+        if downsampled is not None:
+            indexing_expr = (slice(start[2], end[2]),
+                             slice(start[1], end[1]),
+                             slice(start[0], end[0]))
+            if len(downsampled.shape) == 3:
+                subvol = downsampled[indexing_expr]
             else:
-                subvol = downsample.downsample_with_striding(subvol, full_downsample_factor)
+                subvol = downsampled[(np.s_[:], ) + indexing_expr]
+        else:
+            subvol = self._crop_and_downsample(start, end, downsample_factor)
+        if not isinstance(subvol, np.ndarray):
+            # Lazy arrays (dask, zarr, h5py) materialize only the tile-sized
+            # result here.
+            subvol = np.asarray(subvol)
         content_type = 'application/octet-stream'
         if data_format == 'jpeg':
+            if subvol.dtype.kind == 'f':
+                subvol = self._quantize_to_uint8(subvol)
             data = encode_jpeg(subvol)
             content_type = 'image/jpeg'
         elif data_format == 'npz':
@@ -175,5 +321,23 @@ class ServedVolume(object):
             raise ValueError('Invalid data format requested.')
         return data, content_type
 
+    def get_encoded_subvolume_stream(self, data_format, start, end, scale_key='1,1,1'):
+        """Streaming variant of get_encoded_subvolume.
+
+        @return: A tuple (content_type, iterator), where the iterator yields
+            successive pieces of the encoded data, suitable for writing to a
+            chunked transfer-encoding response.  Invalid requests raise
+            ValueError before the iterator is returned.
+        """
+        data, content_type = self.get_encoded_subvolume(data_format, start, end,
+                                                        scale_key=scale_key)
+
+        def iter_chunks():
+            view = memoryview(data)
+            for i in range(0, len(view), STREAM_CHUNK_SIZE):
+                yield view[i:i + STREAM_CHUNK_SIZE]
+
+        return content_type, iter_chunks()
+
     def get_object_mesh(self, object_id):  # pylint: disable=unused-argument,no-self-use
         raise ValueError('Meshes not yet supported.')
@@ -0,0 +1,128 @@
+# @license
+# Copyright 2016 Google Inc.
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Optional numba-compiled kernels for serving subvolume requests.
+
+The kernels fuse the crop and average-pooling downsample into a single pass
+over the requested region, writing directly into a preallocated output
+buffer.  If numba is not installed, crop_downsample returns None and callers
+fall back to the pure-numpy path in neuroglancer.downsample.
+"""
+
+from __future__ import absolute_import, division
+
+import threading
+
+import numpy as np
+
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
+_local = threading.local()
+
+
+def _tile_buffer(shape, dtype):
+    """Returns a per-thread scratch array of the given shape and dtype.
+
+    The underlying allocation is kept on a threading.local and reused across
+    requests, so repeated tile requests on the same server thread do not
+    reallocate.  The returned array is only valid until the next call from
+    the same thread.
+    """
+    dtype = np.dtype(dtype)
+    size = int(np.prod(shape))
+    nbytes = size * dtype.itemsize
+    buf = getattr(_local, 'buf', None)
+    if buf is None or len(buf) < nbytes:
+        buf = _local.buf = bytearray(nbytes)
+    return np.frombuffer(buf, dtype=dtype, count=size).reshape(shape)
+
+if njit is not None:
+
+    @njit(parallel=True, cache=True)
+    def _crop_downsample_3d(data, z0, z1, y0, y1, x0, x1, fz, fy, fx, out):
+        out_z, out_y, out_x = out.shape
+        for oz in prange(out_z):
+            bz0 = z0 + oz * fz
+            bz1 = min(bz0 + fz, z1)
+            for oy in range(out_y):
+                by0 = y0 + oy * fy
+                by1 = min(by0 + fy, y1)
+                for ox in range(out_x):
+                    bx0 = x0 + ox * fx
+                    bx1 = min(bx0 + fx, x1)
+                    total = 0.0
+                    for z in range(bz0, bz1):
+                        for y in range(by0, by1):
+                            for x in range(bx0, bx1):
+                                total += data[z, y, x]
+                    count = (bz1 - bz0) * (by1 - by0) * (bx1 - bx0)
+                    out[oz, oy, ox] = total / count
+
+    @njit(parallel=True, cache=True)
+    def _crop_downsample_4d(data, z0, z1, y0, y1, x0, x1, fz, fy, fx, out):
+        num_channels, out_z, out_y, out_x = out.shape
+        for oz in prange(out_z):
+            bz0 = z0 + oz * fz
+            bz1 = min(bz0 + fz, z1)
+            for oy in range(out_y):
+                by0 = y0 + oy * fy
+                by1 = min(by0 + fy, y1)
+                for ox in range(out_x):
+                    bx0 = x0 + ox * fx
+                    bx1 = min(bx0 + fx, x1)
+                    count = (bz1 - bz0) * (by1 - by0) * (bx1 - bx0)
+                    for c in range(num_channels):
+                        total = 0.0
+                        for z in range(bz0, bz1):
+                            for y in range(by0, by1):
+                                for x in range(bx0, bx1):
+                                    total += data[c, z, y, x]
+                        out[c, oz, oy, ox] = total / count
+
+
+def crop_downsample(data, start, end, downsample_factor, out=None):
+    """Fused crop + averaging downsample of a [z,y,x] or [c,z,y,x] array.
+
+    @param start: (x, y, z) start position in the downsampled grid.
+    @param end: (x, y, z) end position in the downsampled grid.
+    @param downsample_factor: (x, y, z) downsample factor.
+    @param out: optional preallocated output array of the correct shape.  If
+        None, a per-thread scratch buffer is used; the result is then only
+        valid until the next call from the same thread.
+
+    @return: The downsampled array, or None if no compiled kernel applies.
+    """
+    if njit is None:
+        return None
+    if not isinstance(data, np.ndarray) or data.dtype.kind not in 'uif':
+        return None
+    fx, fy, fz = (int(f) for f in downsample_factor)
+    x0, y0, z0 = (int(s) * f for s, f in zip(start, (fx, fy, fz)))
+    x1 = min(int(end[0]) * fx, data.shape[-1])
+    y1 = min(int(end[1]) * fy, data.shape[-2])
+    z1 = min(int(end[2]) * fz, data.shape[-3])
+    out_shape = (-(-(z1 - z0) // fz), -(-(y1 - y0) // fy), -(-(x1 - x0) // fx))
+    if len(data.shape) == 3:
+        if out is None:
+            out = _tile_buffer(out_shape, data.dtype)
+        _crop_downsample_3d(data, z0, z1, y0, y1, x0, x1, fz, fy, fx, out)
+    else:
+        out_shape = (data.shape[0], ) + out_shape
+        if out is None:
+            out = _tile_buffer(out_shape, data.dtype)
+        _crop_downsample_4d(data, z0, z1, y0, y1, x0, x1, fz, fy, fx, out)
+    return out
@@ -30,6 +30,7 @@ import re
 import os
 import collections
 import json
+import logging
 import posixpath
 import binascii
 import numpy as np
@@ -41,6 +42,8 @@ import time
 
 from PIL import Image
 
+logger = logging.getLogger(__name__)
+
 info_path_regex = re.compile(r'^/neuroglancer/info/([^/]+)$')
 
 data_path_regex = re.compile(
@@ -168,7 +171,7 @@ class ServedVolume(object):
     self.mesh_generator = _neuroglancer.OnDemandObjectMeshGenerator(
         data, self.voxel_size, self.offset)
     end_time = time.time()
-    print('generated meshes in %.3f seconds' % (end_time - start_time))
+    logger.debug('generated meshes in %.3f seconds', end_time - start_time)
     with self.mesh_generator_lock:
       self.mesh_generator_pending = False
       self.mesh_generator_lock.notify_all()
@@ -181,7 +184,7 @@ class RequestHandler(BaseHTTPRequestHandler):
   protocol_version = 'HTTP/1.1'
 
   def do_GET(self):
-    #print('GET %s' % self.path)
+    logger.debug('GET %s', self.path)
     m = re.match(data_path_regex, self.path)
     if m is not None:
       global num_requests
@@ -193,7 +196,7 @@ class RequestHandler(BaseHTTPRequestHandler):
           end=(int(m.group(4)), int(m.group(6)), int(m.group(8))))
       end_time = time.time()
       num_requests += 1
-      # print('Request %d took %.4f' % (num_requests, end_time - start_time))
+      logger.debug('Request %d took %.4f', num_requests, end_time - start_time)
       return
     m = re.match(mesh_path_regex, self.path)
     if m is not None: